@@ -1,32 +1,73 @@
 import os
-from pathlib import Path
+import functools
+from dataclasses import dataclass
 from dotenv import load_dotenv, find_dotenv
 
-# Load the .env file from the root directory
-dotenv_path = find_dotenv()
-load_dotenv(dotenv_path)
-
+@dataclass(frozen=True, slots=True)
 class Settings:
     # OpenAI Configuration
-    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
-    OPENAI_EMBEDDING_MODEL: str = "text-embedding-3-small"
-    OPENAI_CHAT_MODEL: str = "gpt-3.5-turbo"
-    
+    OPENAI_API_KEY: str
+    OPENAI_EMBEDDING_MODEL: str
+    OPENAI_CHAT_MODEL: str
+
     # File Upload Settings
-    MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
-    UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "./data/uploads")
-    VECTOR_STORE_PATH: str = os.getenv("VECTOR_STORE_PATH", "./data/vector_store")
-    
+    MAX_FILE_SIZE_MB: int
+    UPLOAD_FOLDER: str
+    VECTOR_STORE_PATH: str
+
     # Server Settings
-    BACKEND_HOST: str = os.getenv("BACKEND_HOST", "localhost")
-    BACKEND_PORT: int = int(os.getenv("BACKEND_PORT", "8000"))
-    
+    BACKEND_HOST: str
+    BACKEND_PORT: int
+
     # Chunking Settings
-    CHUNK_SIZE: int = 1000
-    CHUNK_OVERLAP: int = 200
-    ROWS_PER_CHUNK: int = 50
-    
+    CHUNK_SIZE: int
+    CHUNK_OVERLAP: int
+    ROWS_PER_CHUNK: int
+
     # Vector Search Settings
-    VECTOR_SEARCH_TOP_K: int = 5
+    VECTOR_SEARCH_TOP_K: int
+    EMBED_CONCURRENCY: int
+
+    # OCR Settings
+    OCR_MODEL_CACHE_DIR: str
+    OCR_BATCH_SIZE: int
+    OCR_DET_BS: int
+    OCR_RECO_BS: int
+    OCR_CACHE_DIR: str
+    OCR_RENDER_DPI: int
+    MAX_CONCURRENT_OCR: int
+
+@functools.lru_cache(maxsize=1)
+def _load() -> Settings:
+    """Load the .env file once and build the process-wide settings"""
+    # Skip the directory walk when the .env location is given explicitly
+    if os.environ.get("DOTENV_PATH"):
+        dotenv_path = os.environ["DOTENV_PATH"]
+    else:
+        dotenv_path = find_dotenv()
+    load_dotenv(dotenv_path)
+
+    return Settings(
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY"),
+        OPENAI_EMBEDDING_MODEL="text-embedding-3-small",
+        OPENAI_CHAT_MODEL="gpt-3.5-turbo",
+        MAX_FILE_SIZE_MB=int(os.getenv("MAX_FILE_SIZE_MB", "50")),
+        UPLOAD_FOLDER=os.getenv("UPLOAD_FOLDER", "./data/uploads"),
+        VECTOR_STORE_PATH=os.getenv("VECTOR_STORE_PATH", "./data/vector_store"),
+        BACKEND_HOST=os.getenv("BACKEND_HOST", "localhost"),
+        BACKEND_PORT=int(os.getenv("BACKEND_PORT", "8000")),
+        CHUNK_SIZE=1000,
+        CHUNK_OVERLAP=200,
+        ROWS_PER_CHUNK=50,
+        VECTOR_SEARCH_TOP_K=5,
+        EMBED_CONCURRENCY=int(os.getenv("EMBED_CONCURRENCY", "8")),
+        OCR_MODEL_CACHE_DIR=os.getenv("OCR_MODEL_CACHE_DIR", "./data/model_cache"),
+        OCR_BATCH_SIZE=int(os.getenv("OCR_BATCH_SIZE", "8")),
+        OCR_DET_BS=int(os.getenv("OCR_DET_BS", "8")),
+        OCR_RECO_BS=int(os.getenv("OCR_RECO_BS", "512")),
+        OCR_CACHE_DIR=os.getenv("OCR_CACHE_DIR", "./data/ocr_cache"),
+        OCR_RENDER_DPI=int(os.getenv("OCR_RENDER_DPI", "150")),
+        MAX_CONCURRENT_OCR=int(os.getenv("MAX_CONCURRENT_OCR", "2")),
+    )
 
-settings = Settings()
+settings = _load()
@@ -1,54 +1,149 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Request
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from models.document import DocumentResponse, DocumentDeleteResponse, DocumentList
-from services.document_service import DocumentService
 from utils.logger import logger
 import uvicorn 
 from config import settings
-from services.vector_service import VectorService
 from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
 import os
+import json
 import uuid
-from services.chat_service import ChatService
+import asyncio
+import functools
+import itertools
 from models.chat import ChatRequest,ChatResponse
 
+if TYPE_CHECKING:
+    # Heavy imports (langchain, openai, faiss, docling) are deferred to startup
+    from services.chat_service import ChatService
+    from services.document_service import DocumentService
+    from services.vector_service import VectorService
+
+# Maximum number of queued uploads embedded together in one batch
+INGEST_BATCH_LIMIT = 128
+
+# Service singletons, each constructed exactly once per process
+@functools.lru_cache(maxsize=1)
+def get_vector_service_singleton() -> "VectorService":
+    from services.vector_service import VectorService
+    return VectorService()
+
+@functools.lru_cache(maxsize=1)
+def get_document_service_singleton() -> "DocumentService":
+    from services.document_service import DocumentService
+    return DocumentService()
+
+@functools.lru_cache(maxsize=1)
+def get_chat_service_singleton() -> "ChatService":
+    from services.chat_service import ChatService
+    return ChatService(get_vector_service_singleton())
+
+async def _deferred_init(app: FastAPI):
+    """Construct the services off the event loop, then mark the app ready"""
+    try:
+        vector_service = await asyncio.to_thread(get_vector_service_singleton)
+        document_service = await asyncio.to_thread(get_document_service_singleton)
+        await asyncio.to_thread(get_chat_service_singleton)
+    except Exception as e:
+        # The app can never become ready, so exit and let the supervisor
+        # restart it rather than answer 503 forever
+        logger.exception(f"Error initializing services: {e}")
+        await logger.complete()
+        os._exit(1)
+
+    app.state.ready = True
+    logger.info(f"Application started with {vector_service.get_document_count()} documents in vector store")
+
+    # Warm the OCR models after the app is ready so startup isn't delayed
+    try:
+        await asyncio.to_thread(document_service.warmup_ocr)
+    except Exception as e:
+        # Not fatal: the models load on the first scanned PDF instead
+        logger.warning(f"OCR warmup failed: {e}")
+
+async def _ingest_worker(app: FastAPI):
+    """Drain queued upload chunks so concurrent uploads share one embedding batch"""
+    queue = app.state.ingest_queue
+    while True:
+        chunks_batch = [await queue.get()]
+        while not queue.empty() and len(chunks_batch) < INGEST_BATCH_LIMIT:
+            chunks_batch.append(queue.get_nowait())
+
+        vector_service = get_vector_service_singleton()
+        try:
+            await vector_service.add_documents(
+                list(itertools.chain.from_iterable(chunks_batch))
+            )
+        except Exception as e:
+            logger.exception(f"Error adding queued documents to vector store: {e}")
+            if len(chunks_batch) > 1:
+                # Retry each upload on its own so one bad upload doesn't drop the rest
+                for chunks in chunks_batch:
+                    try:
+                        await vector_service.add_documents(chunks)
+                    except Exception as e:
+                        document_id = chunks[0].metadata.get("document_id") if chunks else None
+                        logger.exception(f"Error adding document {document_id} to vector store: {e}")
+        finally:
+            for _ in chunks_batch:
+                queue.task_done()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global vector_service, document_service
+    app.state.ready = False
     
     # Ensure data directories exist
     os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(settings.VECTOR_STORE_PATH, exist_ok=True)
     
-    # Initialize services
-    app.state.vector_service = VectorService()
-    app.state.document_service = DocumentService()
-    app.state.chat_service = ChatService(app.state.vector_service)
-
-    logger.info(f"Application started with {app.state.vector_service.get_document_count()} documents in vector store")
+    # Initialize services in the background so the port binds immediately
+    init_task = asyncio.create_task(_deferred_init(app))
+    
+    # Single worker that batches vector store ingestion across uploads
+    app.state.ingest_queue = asyncio.Queue()
+    ingest_task = asyncio.create_task(_ingest_worker(app))
     
     yield
     
     # Shutdown
+    if not init_task.done():
+        init_task.cancel()
+
+    # Give already accepted uploads a chance to be indexed
+    try:
+        await asyncio.wait_for(app.state.ingest_queue.join(), timeout=30)
+    except asyncio.TimeoutError:
+        logger.warning("Shutting down with uploads still waiting to be indexed")
+    ingest_task.cancel()
     print("Application shutting down...")
 
 app = FastAPI(
     title= "AI Document QA Agent",
     description= "Intelligent document Question-Answering system using RAG with support for text and tables",
     version="1.0.0",
-    lifespan= lifespan
+    lifespan= lifespan,
+    openapi_url=None if os.environ.get("DISABLE_DOCS") else "/openapi.json"
 )
 
 # Dependency functions
-def get_vector_service(request: Request) -> VectorService:
-    return request.app.state.vector_service
+def _ensure_ready(request: Request) -> None:
+    if not request.app.state.ready:
+        raise HTTPException(status_code=503, detail="Service is still initializing")
+
+def get_vector_service(request: Request) -> "VectorService":
+    _ensure_ready(request)
+    return get_vector_service_singleton()
 
-def get_document_service(request: Request) -> DocumentService:
-    return request.app.state.document_service
+def get_document_service(request: Request) -> "DocumentService":
+    _ensure_ready(request)
+    return get_document_service_singleton()
 
-def get_chat_service(request: Request) -> ChatService:
-    return request.app.state.chat_service
+def get_chat_service(request: Request) -> "ChatService":
+    _ensure_ready(request)
+    return get_chat_service_singleton()
 
 app.add_middleware(
     CORSMiddleware,
@@ -67,39 +162,36 @@ async def root():
         "docs": "/docs"
     }
 
-@app.get("/")
-async def root():
-    """Root endpoint"""
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness endpoint, available as soon as the port is bound"""
     return {
-        "message": "AI Document QA Agent API",
-        "version": "1.0.0",
-        "docs": "/docs"
+        "status": "alive",
+        "service": "AI Document QA Agent"
     }
 
-@app.get("/health")
-async def health_check(vector_service: VectorService = Depends(get_vector_service)):
-    """Health check endpoint"""
+@app.get("/health/ready")
+async def readiness_check(request: Request):
+    """Readiness endpoint, returns 503 until the services are initialized"""
+    if not request.app.state.ready:
+        raise HTTPException(status_code=503, detail="Service is still initializing")
+
     return {
         "status": "healthy",
         "service": "AI Document QA Agent",
-        "documents_count": vector_service.get_document_count() if vector_service else 0
+        "documents_count": get_vector_service_singleton().get_document_count()
     }
 
 @app.post("/documents/upload", response_model= DocumentResponse)
-async def upload_document(background_tasks: BackgroundTasks,
+async def upload_document(request: Request,
                           file: UploadFile = File(...,description="upload file to process of pdf, txt, docx format"),
-                          document_service: DocumentService = Depends(get_document_service),
-                          vector_service: VectorService = Depends(get_vector_service)):
+                          document_service: "DocumentService" = Depends(get_document_service)):
     """ upload and process document for QA"""
     try:
-        file_content = await file.read()
-        result = await document_service.process_document(file_content, file.filename)
+        result = await document_service.process_document(file)
 
-        # Add chunks to vector store in background
-        background_tasks.add_task(
-            vector_service.add_documents,
-            result["chunks"]
-        )
+        # Queue chunks for the background ingest worker
+        await request.app.state.ingest_queue.put(result["chunks"])
 
         return DocumentResponse(
             document_id = result["document_id"],
@@ -118,7 +210,7 @@ async def upload_document(background_tasks: BackgroundTasks,
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    chat_service: ChatService = Depends(get_chat_service),
+    chat_service: "ChatService" = Depends(get_chat_service),
 ):
     """Process chat query using RAG"""
 
@@ -150,34 +242,36 @@ async def chat(
             error_message=str(e)
         )
 
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    chat_service: "ChatService" = Depends(get_chat_service),
+):
+    """Process chat query using RAG, streaming the answer as newline-delimited JSON events"""
+
+    async def events():
+        if chat_service.vector_service.get_document_count() == 0:
+            yield json.dumps({
+                'type': 'error',
+                'answer': "I don't have any documents to search through. Please upload some documents first.",
+                'error_message': "No documents available"
+            }) + "\n"
+            return
+
+        async for event in chat_service.stream_response(
+            message=request.message,
+            session_id=request.session_id
+        ):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @app.get("/documents", response_model=DocumentList)
-async def list_documents(vector_service: VectorService = Depends(get_vector_service)):
+async def list_documents(vector_service: "VectorService" = Depends(get_vector_service)):
     """List all processed documents"""
     try:
         # Get unique documents from vector store
-        documents_info = {}
-        
-        for doc in vector_service.documents:
-            doc_id = doc.metadata['document_id']
-            filename = doc.metadata['filename']
-            
-            if doc_id not in documents_info:
-                documents_info[doc_id] = {
-                    'document_id': doc_id,
-                    'filename': filename,
-                    'total_chunks': 0,
-                    'text_chunks': 0,
-                    'table_chunks': 0
-                }
-            
-            documents_info[doc_id]['total_chunks'] += 1
-            
-            if doc.metadata.get('chunk_type') == 'table':
-                documents_info[doc_id]['table_chunks'] += 1
-            else:
-                documents_info[doc_id]['text_chunks'] += 1
-        
-        documents_list = list(documents_info.values())
+        documents_list = vector_service.summarize_documents()
         
         return DocumentList(
             documents=documents_list,
@@ -190,10 +284,10 @@ async def list_documents(vector_service: VectorService = Depends(get_vector_serv
 
 @app.delete("/documents/{document_id}", response_model=DocumentDeleteResponse)
 async def delete_document(document_id: str,
-                          vector_service: VectorService = Depends(get_vector_service)):
+                          vector_service: "VectorService" = Depends(get_vector_service)):
     """Delete a specific document from the system"""
     try:
-        result = vector_service.clear_documents(document_id)
+        result = await vector_service.clear_documents(document_id)
         
         return DocumentDeleteResponse(
             document_id=document_id,
@@ -207,7 +301,7 @@ async def delete_document(document_id: str,
 
 @app.get("/sessions/{session_id}")
 async def get_session_info(session_id: str,
-                           chat_service: ChatService = Depends(get_chat_service)):
+                           chat_service: "ChatService" = Depends(get_chat_service)):
     """Get information about a chat session"""
     session_info = chat_service.get_session_info(session_id)
     
@@ -218,7 +312,7 @@ async def get_session_info(session_id: str,
 
 @app.delete("/sessions/{session_id}")
 async def clear_session(session_id: str,
-                        chat_service: ChatService = Depends(get_chat_service)):
+                        chat_service: "ChatService" = Depends(get_chat_service)):
     """Clear a specific chat session"""
     success = chat_service.clear_session(session_id)
     
@@ -232,4 +326,6 @@ if __name__ == "__main__":
     uvicorn.run("main:app",
                 host = settings.BACKEND_HOST,
                 port = settings.BACKEND_PORT,
-                reload= True)
\ No newline at end of file
+                # Single worker only: the vector store, chat sessions and
+                # ingest queue all live in this process
+                reload= os.environ.get("DEV") == "1")
\ No newline at end of file
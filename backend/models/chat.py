@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 
 class ChatRequest(BaseModel):
     message: str
@@ -19,6 +19,6 @@ class ChatResponse(BaseModel):
     answer: str
     sources: List[Source]
     session_id: str
-    timestamp: datetime = datetime.utcnow()
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     success: bool = True
     error_message: Optional[str] = None
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 class DocumentResponse(BaseModel):
@@ -9,7 +9,7 @@ class DocumentResponse(BaseModel):
     total_chunks: int
     status : str
     message : str
-    timestamp : datetime = datetime.utcnow()
+    timestamp : datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class DocumentUpload(BaseModel):
     filename: str
@@ -1,37 +1,129 @@
-from typing import Dict, Any, List, Optional
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, AIMessage
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, List, Optional, Tuple
+from collections import deque
+from cachetools import TTLCache
+import functools
 import uuid
 
 from config import settings
-from services.vector_service import VectorService
-from models.chat import Source
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from services.vector_service import VectorService
+
+# Built once at import; only the placeholders are filled per request
+_PROMPT_TEMPLATE = (
+    "You are an AI assistant helping users understand documents and tables they've uploaded.\n"
+    "Use the following context from the documents to answer the user's question accurately and cite your sources.\n"
+    "\n"
+    "Context from documents:\n"
+    "{context}\n"
+    "\n"
+    "Previous conversation:\n"
+    "{chat_history}\n"
+    "\n"
+    "Instructions:\n"
+    "1. Answer based on the provided context from the uploaded documents\n"
+    "2. If the information is not in the context, clearly state that you cannot find the answer in the uploaded documents\n"
+    "3. When referencing tables, mention the table structure and specific data points\n"
+    "4. Be specific about which document or section your answer comes from\n"
+    "5. If multiple sources support your answer, mention them all\n"
+    "6. Keep your response concise but comprehensive\n"
+    "\n"
+    "Current question: {question}\n"
+    "\n"
+    "Answer:"
+)
+
+# Returned instead of calling the LLM when retrieval finds nothing
+_NO_RESULTS_ANSWER = "I couldn't find relevant content in the uploaded documents to answer your question."
+
+@functools.lru_cache(maxsize=1)
+def get_llm() -> "ChatOpenAI":
+    """Shared chat model so every ChatService reuses one HTTP connection pool"""
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        openai_api_key=settings.OPENAI_API_KEY,
+        model_name=settings.OPENAI_CHAT_MODEL,
+        temperature=0.7
+    )
 
 class ChatService:
-    def __init__(self, vector_service: VectorService):
+    def __init__(self, vector_service: "VectorService"):
         self.vector_service = vector_service
-        self.llm = ChatOpenAI(
-            openai_api_key=settings.OPENAI_API_KEY,
-            model_name=settings.OPENAI_CHAT_MODEL,
-            temperature=0.7
-        )
+        self.llm = get_llm()
         
         # Simple session storage (in production, use Redis or database)
-        self.sessions = {}
+        # Bounded so abandoned sessions are evicted after an hour of inactivity
+        self.sessions = TTLCache(maxsize=10_000, ttl=3600)
     
-    async def get_response(self, message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
-        """Generate response using RAG"""
-        
+    def _get_session(self, session_id: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        """Return the session for an id, creating the id and/or session if new"""
         # Create session ID if not provided
         if not session_id:
             session_id = str(uuid.uuid4())
         
         # Initialize session if new
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                'history': [],
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {
+                # Already formatted lines for the last 5 exchanges
+                'formatted': deque(maxlen=10),
+                'message_count': 0,
                 'created_at': str(uuid.uuid4())
             }
+        return session_id, session
+    
+    def _build_context(self, search_results: List[Dict]) -> Tuple[str, List[Dict[str, Any]]]:
+        """Format the prompt context and the source citations from search results"""
+        # Format context from search results, one string per hit
+        context = "\n---\n".join(
+            f"Source: {result['document'].metadata['filename']}\nContent: {result['document'].page_content}"
+            for result in search_results
+        )
+        
+        sources = []
+        for result in search_results:
+            doc = result['document']
+            metadata = doc.metadata
+            page_content = doc.page_content
+            chunk_type = metadata.get('chunk_type', 'text')
+            
+            # Create source information as a plain dict; ChatResponse
+            # validates it against the Source model once at the endpoint
+            source = {
+                'filename': metadata['filename'],
+                'chunk_id': metadata['chunk_id'],
+                'content_preview': page_content[:200] + "..." if len(page_content) > 200 else page_content,
+                'chunk_type': chunk_type,
+                'similarity_score': result['similarity_score']
+            }
+            
+            # Add table-specific information
+            if chunk_type == 'table':
+                source['table_info'] = {
+                    'shape': metadata.get('table_shape'),
+                    'columns': metadata.get('table_columns', [])
+                }
+            
+            sources.append(source)
+        
+        return context, sources
+    
+    def _remember_turn(self, session_id: str, session: Dict[str, Any], message: str, answer: str):
+        """Append an exchange to the session history"""
+        session['formatted'].append(f"Human: {message}")
+        session['formatted'].append(f"Assistant: {answer}")
+        session['message_count'] += 2
+        
+        # Re-insert so the session's TTL restarts from this turn
+        self.sessions[session_id] = session
+    
+    async def get_response(self, message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Generate response using RAG"""
+        from langchain.schema import HumanMessage
+        
+        session_id, session = self._get_session(session_id)
         
         try:
             # Search for relevant documents
@@ -40,35 +132,16 @@ class ChatService:
                 k=settings.VECTOR_SEARCH_TOP_K
             )
             
-            # Format context from search results
-            context_parts = []
-            sources = []
-            
-            for result in search_results:
-                doc = result['document']
-                context_parts.append(f"Source: {doc.metadata['filename']}")
-                context_parts.append(f"Content: {doc.page_content}")
-                context_parts.append("---")
-                
-                # Create source information
-                source = Source(
-                    filename=doc.metadata['filename'],
-                    chunk_id=doc.metadata['chunk_id'],
-                    content_preview=doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    chunk_type=doc.metadata.get('chunk_type', 'text'),
-                    similarity_score=result['similarity_score']
-                )
-                
-                # Add table-specific information
-                if doc.metadata.get('chunk_type') == 'table':
-                    source.table_info = {
-                        'shape': doc.metadata.get('table_shape'),
-                        'columns': doc.metadata.get('table_columns', [])
-                    }
-                
-                sources.append(source)
-            
-            context = "\n".join(context_parts)
+            # Nothing relevant retrieved, so skip the LLM round-trip
+            if not search_results:
+                return {
+                    'answer': _NO_RESULTS_ANSWER,
+                    'sources': [],
+                    'session_id': session_id,
+                    'success': True
+                }
+            
+            context, sources = self._build_context(search_results)
             
             # Get chat history
             chat_history = self._format_chat_history(session_id)
@@ -81,22 +154,11 @@ class ChatService:
             answer = response.generations[0][0].text
             
             # Update session history
-            self.sessions[session_id]['history'].append({
-                'type': 'human',
-                'content': message
-            })
-            self.sessions[session_id]['history'].append({
-                'type': 'ai',
-                'content': answer
-            })
-            
-            # Keep only last 10 exchanges
-            if len(self.sessions[session_id]['history']) > 20:
-                self.sessions[session_id]['history'] = self.sessions[session_id]['history'][-20:]
+            self._remember_turn(session_id, session, message, answer)
             
             return {
                 'answer': answer,
-                'sources': [source.dict() for source in sources],
+                'sources': sources,
                 'session_id': session_id,
                 'success': True
             }
@@ -111,46 +173,66 @@ class ChatService:
                 'error_message': str(e)
             }
     
+    async def stream_response(self, message: str, session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Generate response using RAG, yielding the sources first and then the answer as it is produced.
+
+        Events are dicts with a 'type' of 'sources', 'token', 'done' or 'error'.
+        """
+        from langchain.schema import HumanMessage
+        
+        session_id, session = self._get_session(session_id)
+        
+        try:
+            # Search for relevant documents
+            search_results = await self.vector_service.similarity_search(
+                query=message,
+                k=settings.VECTOR_SEARCH_TOP_K
+            )
+            
+            # Nothing relevant retrieved, so skip the LLM round-trip
+            if not search_results:
+                yield {'type': 'sources', 'sources': [], 'session_id': session_id}
+                yield {'type': 'token', 'content': _NO_RESULTS_ANSWER}
+                yield {'type': 'done', 'success': True}
+                return
+            
+            context, sources = self._build_context(search_results)
+            yield {'type': 'sources', 'sources': sources, 'session_id': session_id}
+            
+            prompt = self._create_prompt(context, self._format_chat_history(session_id), message)
+            
+            # Forward tokens as the model produces them
+            parts = []
+            async for chunk in self.llm.astream([HumanMessage(content=prompt)]):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {'type': 'token', 'content': chunk.content}
+            
+            self._remember_turn(session_id, session, message, "".join(parts))
+            yield {'type': 'done', 'success': True}
+            
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield {
+                'type': 'error',
+                'answer': f"I apologize, but I encountered an error while processing your question: {str(e)}",
+                'error_message': str(e)
+            }
+    
     def _format_chat_history(self, session_id: str) -> str:
         """Format chat history for context"""
         if session_id not in self.sessions:
             return ""
         
-        history = self.sessions[session_id]['history']
-        if not history:
-            return ""
-        
-        formatted_history = []
-        for entry in history[-10:]:  # Last 5 exchanges
-            if entry['type'] == 'human':
-                formatted_history.append(f"Human: {entry['content']}")
-            else:
-                formatted_history.append(f"Assistant: {entry['content']}")
-        
-        return "\n".join(formatted_history)
+        return "\n".join(self.sessions[session_id]['formatted'])
     
     def _create_prompt(self, context: str, chat_history: str, question: str) -> str:
         """Create the prompt for the LLM"""
-        return f"""You are an AI assistant helping users understand documents and tables they've uploaded. 
-                    Use the following context from the documents to answer the user's question accurately and cite your sources.
-
-                    Context from documents:
-                    {context}
-
-                    Previous conversation:
-                    {chat_history}
-
-                    Instructions:
-                    1. Answer based on the provided context from the uploaded documents
-                    2. If the information is not in the context, clearly state that you cannot find the answer in the uploaded documents
-                    3. When referencing tables, mention the table structure and specific data points
-                    4. Be specific about which document or section your answer comes from
-                    5. If multiple sources support your answer, mention them all
-                    6. Keep your response concise but comprehensive
-
-                    Current question: {question}
-
-                    Answer:"""
+        return _PROMPT_TEMPLATE.format_map({
+            "context": context,
+            "chat_history": chat_history,
+            "question": question
+        })
     
     def get_session_info(self, session_id: str) -> Dict[str, Any]:
         """Get information about a chat session"""
@@ -158,7 +240,7 @@ class ChatService:
             session = self.sessions[session_id]
             return {
                 'session_id': session_id,
-                'message_count': len(session['history']),
+                'message_count': session['message_count'],
                 'created_at': session['created_at']
             }
         return None
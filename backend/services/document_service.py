@@ -1,66 +1,148 @@
 from typing import Dict, Any
-from utils.file_utils import validate_file_type
+from fastapi import UploadFile
+from utils.file_utils import ALLOWED_EXTENSIONS, get_file_extension
 from config import settings
-from pathlib import Path
 import tempfile
+import io
 from utils.logger import logger
-from typing import List, Tuple, Dict, Any
+from typing import List, Dict, Any, Optional
 import pandas as pd
 from utils.text_utils import DoclingPDFLoader
 import fitz
 import os
-import time
+import asyncio
+import aiofiles
 import uuid
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
+import threading
+import hashlib
+import numpy as np
+from PIL import Image
+import onnxruntime as ort
+from onnxtr.io import DocumentFile
+from onnxtr.models import EngineConfig, ocr_predictor
 from ocrmypdf.hocrtransform import HocrTransform
-from pypdf import PdfWriter, PdfReader
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# Size of each read from the upload stream while spooling it to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# RAM-backed scratch space for OCR intermediates on Linux; None means the default temp dir
+OCR_SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Part of every OCR cache key, so changing the models invalidates old entries
+OCR_CACHE_KEY_PREFIX = b"onnxtr:fast_base:parseq:"
+
+def _ocr_engine_config() -> EngineConfig:
+    """Prefer TensorRT, then CUDA, then CPU, depending on what onnxruntime provides"""
+    available = set(ort.get_available_providers())
+    providers = []
+    if "TensorrtExecutionProvider" in available:
+        # FP16 engines are built on first use and cached on disk
+        providers.append(("TensorrtExecutionProvider", {
+            "trt_fp16_enable": True,
+            "trt_engine_cache_enable": True,
+            "trt_engine_cache_path": settings.OCR_MODEL_CACHE_DIR,
+        }))
+    if "CUDAExecutionProvider" in available:
+        providers.append(("CUDAExecutionProvider", {}))
+    providers.append(("CPUExecutionProvider", {}))
+    return EngineConfig(providers=providers)
+
+def _build_ocr_predictor():
+    """Build the OnnxTR OCR predictor, using 8-bit models when running on CPU only"""
+    os.makedirs(settings.OCR_MODEL_CACHE_DIR, exist_ok=True)
+    engine_cfg = _ocr_engine_config()
+    cpu_only = all(name == "CPUExecutionProvider" for name, _ in engine_cfg.providers)
+    return ocr_predictor(
+        det_arch="fast_base",
+        reco_arch="parseq",
+        det_bs=settings.OCR_DET_BS,
+        reco_bs=settings.OCR_RECO_BS,
+        load_in_8_bit=cpu_only,
+        det_engine_cfg=engine_cfg,
+        reco_engine_cfg=engine_cfg,
+        clf_engine_cfg=engine_cfg,
+    )
+
 class DocumentService:
     def __init__(self):
         # Ensure upload directory exists
         os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
 
-    async def process_document(self, file_content:bytes, filename:str) -> Dict[str,Any]:
+        os.makedirs(settings.OCR_CACHE_DIR, exist_ok=True)
+
+        # OCR models are loaded on first use (or by warmup_ocr) and then reused
+        self._predictor = None
+        self._predictor_lock = threading.Lock()
+        self._ocr_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_OCR)
+
+        # Chunking settings are fixed for the process, so one splitter serves every document
+        self._text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size = settings.CHUNK_SIZE,
+            chunk_overlap = settings.CHUNK_OVERLAP,
+            separators= ["\n\n","\n"," ",""]
+        )
+
+    def _get_predictor(self):
+        """Return the shared OCR predictor, building it on first use"""
+        if self._predictor is None:
+            with self._predictor_lock:
+                if self._predictor is None:
+                    self._predictor = _build_ocr_predictor()
+        return self._predictor
+
+    def warmup_ocr(self) -> None:
+        """Load the OCR models and run one dummy forward so the first scanned PDF doesn't pay for it"""
+        self._get_predictor()([np.zeros((1024, 1024, 3), dtype=np.uint8)])
+        logger.info("OCR predictor warmed up")
+
+    async def process_document(self, upload:UploadFile) -> Dict[str,Any]:
         """Process uploaded document"""
+        filename = upload.filename
 
-        if not validate_file_type(filename):
+        file_extension = get_file_extension(filename)
+        if file_extension not in ALLOWED_EXTENSIONS:
             raise ValueError(f"unsupported file type, Supported file types: .pdf, .txt, .docx")
         
-        file_size_mb = len(file_content)/(1024*1024)
-        if file_size_mb > settings.MAX_FILE_SIZE_MB:
-            raise ValueError(f"File size ({file_size_mb:.1f}MB) exceeds maximum allowed size({settings.MAX_FILE_SIZE_MB}MB)")
-        
-        file_extension = Path(filename).suffix.lower()
-        temp_file_path = self.save_temp_file(file_content, file_extension)
+        temp_file_path = await self.save_temp_file(upload, file_extension)
 
         #generate document ID
         document_id = str(uuid.uuid4())
         logger.info(f"Document id generated for the current document: {document_id}")
 
-        if file_extension == ".pdf":
-            logger.info("processing pdf file")
-            md_text_content = self.process_pdf(temp_file_path)
-            logger.info("completed extracting md text content")
-            md_text_content = md_text_content[0].page_content
-            logger.info(f"type of md_text content is {type(md_text_content)}")
-            chunks = self.create_text_chunks(md_text_content,document_id,filename)
-        elif file_extension == '.docx':
-            md_text_content= self.get_markdown(temp_file_path)
-            md_text_content = md_text_content[0].page_content
-            chunks = self.create_text_chunks(md_text_content,document_id,filename)
-        elif file_extension == '.txt':
-            md_text_content = self.get_markdown(temp_file_path)
-            md_text_content = md_text_content[0].page_content
-            chunks = self.create_text_chunks(md_text_content,document_id,filename)
-        elif file_extension == '.xlsx':
-            md_text_content = self.get_markdown(temp_file_path)
-            md_text_content = md_text_content[0].page_content
-            chunks = self.split_markdown_table_by_rows(md_text_content,document_id,filename,settings.ROWS_PER_CHUNK)
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
+        try:
+            # Conversion and chunking are blocking CPU/IO work; run them in
+            # worker threads so other requests keep being served meanwhile
+            if file_extension == ".pdf":
+                logger.info("processing pdf file")
+                # Bound concurrent PDF/OCR jobs to limit memory and GPU pressure
+                async with self._ocr_semaphore:
+                    md_text_content = await asyncio.to_thread(self.process_pdf, temp_file_path)
+                logger.info("completed extracting md text content")
+                md_text_content = md_text_content[0].page_content
+                logger.info(f"type of md_text content is {type(md_text_content)}")
+                chunks = await asyncio.to_thread(self.create_text_chunks, md_text_content, document_id, filename)
+            elif file_extension == '.docx':
+                md_text_content = await asyncio.to_thread(self.get_markdown, temp_file_path)
+                md_text_content = md_text_content[0].page_content
+                chunks = await asyncio.to_thread(self.create_text_chunks, md_text_content, document_id, filename)
+            elif file_extension == '.txt':
+                md_text_content = await asyncio.to_thread(self.get_markdown, temp_file_path)
+                md_text_content = md_text_content[0].page_content
+                chunks = await asyncio.to_thread(self.create_text_chunks, md_text_content, document_id, filename)
+            elif file_extension == '.xlsx':
+                md_text_content = await asyncio.to_thread(self.get_markdown, temp_file_path)
+                md_text_content = md_text_content[0].page_content
+                chunks = await asyncio.to_thread(self.split_markdown_table_by_rows, md_text_content, document_id, filename, settings.ROWS_PER_CHUNK)
+            else:
+                raise ValueError(f"Unsupported file type: {file_extension}")
+        finally:
+            # The upload is only needed on disk while it is being converted
+            try:
+                os.remove(temp_file_path)
+            except OSError:
+                pass
 
         logger.info(f"Extracting markdown text and chunking is completed for current file{filename}")
         logger.info(f"chunking completed total chunks are {len(chunks)}")
@@ -71,17 +153,43 @@ class DocumentService:
             "total_chunks": len(chunks)
         }
 
-    def save_temp_file(self, file_content:bytes, extension:str) -> str:
-        """save uploaded file to temporary location"""
-        temp_file = tempfile.NamedTemporaryFile(
-            delete = False,
-            suffix = extension,
-            dir = settings.UPLOAD_FOLDER
-        )
+    async def save_temp_file(self, upload:UploadFile, extension:str) -> str:
+        """stream uploaded file to temporary location, aborting once it exceeds the size limit"""
+        max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+        temp_file_path = os.path.join(settings.UPLOAD_FOLDER, f"{uuid.uuid4().hex}{extension}")
+        running_size = 0
+
+        # Exclusive, owner-only create; O_BINARY only exists (and matters) on Windows
+        fd = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+        try:
+            try:
+                # Preallocate when the client announced the size (best effort)
+                if upload.size and upload.size <= max_bytes and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(fd, 0, upload.size)
+                    except OSError:
+                        pass
 
-        temp_file.write(file_content)
-        temp_file.close()
-        return temp_file.name
+                async with aiofiles.open(fd, "wb", closefd=False) as dest:
+                    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                        running_size += len(chunk)
+                        if running_size > max_bytes:
+                            raise ValueError(f"File size exceeds maximum allowed size({settings.MAX_FILE_SIZE_MB}MB)")
+                        await dest.write(chunk)
+
+                # Drop any preallocated tail if fewer bytes arrived than announced
+                os.ftruncate(fd, running_size)
+            finally:
+                os.close(fd)
+        except Exception:
+            # Don't leave a partial upload behind
+            try:
+                os.remove(temp_file_path)
+            except OSError:
+                pass
+            raise
+
+        return temp_file_path
     
 
     def get_markdown(self, file_path:str)-> list:
@@ -95,12 +203,12 @@ class DocumentService:
         Detect if a PDF is scanned (image-based) or contains selectable text.
         Returns True if scanned, False otherwise.
         """
-        pdf = fitz.open(pdf_path)
-        for page in pdf:
-            text = page.get_text()
-            if text.strip():
-                logger.info(f"This is not scanned pdf {pdf_path}")
-                return False  # Found actual text → Not scanned
+        with fitz.open(pdf_path) as pdf:
+            for page in pdf:
+                # Word extraction without layout flags is the cheapest text probe
+                if page.get_text("words", flags=0):
+                    logger.info(f"This is not scanned pdf {pdf_path}")
+                    return False  # Found actual text → Not scanned
         logger.info(f"This is scanned pdf {pdf_path}")
         return True
         
@@ -119,61 +227,44 @@ class DocumentService:
             raise ValueError(f"Error processing PDF file: {str(e)}")
         return md_text
     
-    def _unique_tmp_path(self,suffix: str) -> str:
+    def _unique_tmp_path(self,suffix: str, directory: Optional[str] = None) -> str:
         """Create a unique temp file path without opening the file."""
-        return os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}{suffix}")
+        return os.path.join(directory or tempfile.gettempdir(), f"{uuid.uuid4().hex}{suffix}")
 
 
-    def _save_pixmap_png_atomic(self,pix: fitz.Pixmap, target_path: str, retries: int = 3, delay: float = 0.1) -> None:
-        """Save pixmap to PNG path with retries to avoid transient Windows locks."""
-        for attempt in range(retries):
-            try:
-                # Ensure parent dir exists
-                os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                # If file exists, remove it first (best effort)
-                if os.path.exists(target_path):
-                    try:
-                        os.remove(target_path)
-                    except Exception:
-                        pass
-                pix.save(target_path)  # This calls fz_save_pixmap_as_png internally
-                return
-            except Exception as e:
-                if attempt == retries - 1:
-                    raise
-                time.sleep(delay)
-
-
-    def _render_pdf_pages_to_images(self,pdf_path: str, dpi: int = 300) -> List[str]:
-        """Render each page of a PDF to a PNG and return the paths, avoiding open handles."""
-        img_paths: List[str] = []
-        doc = fitz.open(pdf_path)
-        try:
-            for page_index in range(len(doc)):
-                page = doc[page_index]
-                pix = page.get_pixmap(dpi=dpi)
-                img_path = self._unique_tmp_path(".png")
-                self._save_pixmap_png_atomic(pix, img_path)
-                img_paths.append(img_path)
-        finally:
-            # Ensure the document is fully closed before any deletes
-            doc.close()
-        return img_paths
-
-
-    def _merge_pdfs(self,single_page_paths: List[str], out_path: str) -> None:
-        writer = PdfWriter()
-        for p in single_page_paths:
-            reader = PdfReader(p)
-            for i in range(len(reader.pages)):
-                writer.add_page(reader.pages[i])
-        with open(out_path, "wb") as f:
-            writer.write(f)
+    def _page_digest(self, page: np.ndarray) -> str:
+        """Content hash of a page image, used as the OCR cache key"""
+        digest = hashlib.sha256(OCR_CACHE_KEY_PREFIX)
+        digest.update(str(page.shape).encode())
+        digest.update(np.ascontiguousarray(page).data)
+        return digest.hexdigest()
 
+    def _read_cached_hocr(self, digest: str) -> Optional[bytes]:
+        """Return cached hOCR for a page digest, or None on a miss"""
+        try:
+            with open(os.path.join(settings.OCR_CACHE_DIR, f"{digest}.hocr"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cached_hocr(self, digest: str, xml_bytes: bytes) -> None:
+        """Persist hOCR for a page digest atomically"""
+        cache_path = os.path.join(settings.OCR_CACHE_DIR, f"{digest}.hocr")
+        tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(xml_bytes)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write OCR cache entry {cache_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
-    def ocr_and_replace_pdf(self, pdf_path: str, dpi: int = 300) -> str:
+    def ocr_and_replace_pdf(self, pdf_path: str, dpi: int = settings.OCR_RENDER_DPI) -> str:
         """
-        Run OCR on scanned PDF using docTR, create a searchable PDF,
+        Run OCR on scanned PDF using OnnxTR, create a searchable PDF,
         and overwrite the input file with the new searchable version.
         """
         if not os.path.exists(pdf_path):
@@ -181,90 +272,95 @@ class DocumentService:
 
         logger.info(f"Running OCR on: {pdf_path}")
 
-        # 1) Load PDF into docTR
-        docs = DocumentFile.from_pdf(pdf_path)
-
-        # 2) Model + inference
-        predictor = ocr_predictor(pretrained=True)
-        result = predictor(docs)
-
-        # 3) Export per-page hOCR/XML
-        xml_pages: List[Tuple[bytes, object]] = result.export_as_xml()
-
-        # 4) Render pages to images
-        page_images = self._render_pdf_pages_to_images(pdf_path, dpi=dpi)
-
-        if len(xml_pages) != len(page_images):
-            raise RuntimeError(
-                f"Page count mismatch between OCR output ({len(xml_pages)}) and rendered images ({len(page_images)})"
-            )
-
-        single_page_outputs: List[str] = []
-        hocr_files: List[str] = []
-        merged_pdf_tmp = self._unique_tmp_path(".pdf")  # temp final PDF path
-
-        try:
-            # 5) Build searchable single-page PDFs
-            for i, (xml_bytes, _xml_tree) in enumerate(xml_pages):
-                hocr_path = self._unique_tmp_path(".hocr")
-                with open(hocr_path, "wb") as hf:
-                    hf.write(xml_bytes)
-                hocr_files.append(hocr_path)
-
-                out_pdf_path = self._unique_tmp_path(".pdf")
-                hocr = HocrTransform(hocr_filename=hocr_path, dpi=float(dpi))
-                hocr.to_pdf(
-                    out_filename=out_pdf_path,
-                    image_filename=page_images[i]
-                )
-                single_page_outputs.append(out_pdf_path)
-
-            # 6) Merge all single-page PDFs into a temporary final file
-            self._merge_pdfs(single_page_outputs, merged_pdf_tmp)
-
-            # 7) Atomically replace the original with OCR result
-            os.replace(merged_pdf_tmp, pdf_path)
-
-            logger.info(f"OCR complete. Searchable PDF overwritten at: {pdf_path}")
-            return pdf_path
-
-        finally:
-            # Cleanup temporary files but never touch the final pdf_path
-            for p in page_images + single_page_outputs + hocr_files:
+        # 1) Load PDF into OnnxTR at the DPI the hOCR coordinates are expressed in;
+        #    these arrays are also reused as the image layer of the output
+        docs = DocumentFile.from_pdf(pdf_path, scale=dpi / 72)
+
+        # 2) Reuse cached hOCR for pages seen before, keyed on page content
+        page_digests = [self._page_digest(page) for page in docs]
+        xml_pages: List[Optional[bytes]] = [self._read_cached_hocr(d) for d in page_digests]
+        missing = [i for i, xml_bytes in enumerate(xml_pages) if xml_bytes is None]
+        logger.info(f"OCR cache hits: {len(docs) - len(missing)}/{len(docs)} pages")
+
+        # 3) Inference on the remaining pages, several pages per forward,
+        #    exporting per-page hOCR/XML back into page order
+        if missing:
+            predictor = self._get_predictor()
+            for start in range(0, len(missing), settings.OCR_BATCH_SIZE):
+                batch_indices = missing[start:start + settings.OCR_BATCH_SIZE]
+                result = predictor([docs[i] for i in batch_indices])
+                for i, (xml_bytes, _xml_tree) in zip(batch_indices, result.export_as_xml()):
+                    xml_pages[i] = xml_bytes
+                    self._write_cached_hocr(page_digests[i], xml_bytes)
+
+        # Staged beside the original so the final os.replace stays on one filesystem
+        merged_pdf_tmp = self._unique_tmp_path(".pdf", os.path.dirname(os.path.abspath(pdf_path)))
+
+        # hOCR intermediates live in RAM-backed tmpfs where available and are
+        # removed with the directory
+        with tempfile.TemporaryDirectory(dir=OCR_SCRATCH_DIR) as scratch_dir:
+            try:
+                # 4) Build a searchable PDF page by page, encoding each already
+                #    decoded page as its image layer instead of re-rasterizing the PDF.
+                #    Each single-page PDF is rendered into memory and streamed
+                #    straight into the merged document rather than round-tripping disk
+                with fitz.open() as merged:
+                    for i, xml_bytes in enumerate(xml_pages):
+                        # HocrTransform only parses hOCR from a file path
+                        hocr_path = self._unique_tmp_path(".hocr", scratch_dir)
+                        with open(hocr_path, "wb") as hf:
+                            hf.write(xml_bytes)
+
+                        page_pdf = io.BytesIO()
+                        hocr = HocrTransform(hocr_filename=hocr_path, dpi=float(dpi))
+                        hocr.to_pdf(
+                            out_filename=page_pdf,
+                            image_filename=Image.fromarray(docs[i])
+                        )
+                        with fitz.open(stream=page_pdf.getvalue(), filetype="pdf") as src:
+                            merged.insert_pdf(src)
+
+                    # 5) Write the merged document to a temporary final file
+                    merged.save(merged_pdf_tmp, garbage=4, deflate=True)
+
+                # 6) Atomically replace the original with OCR result
+                os.replace(merged_pdf_tmp, pdf_path)
+
+            except Exception:
+                # Never leave a partial merge behind; pdf_path is untouched until the replace
                 try:
-                    os.remove(p)
-                except Exception:
+                    os.remove(merged_pdf_tmp)
+                except OSError:
                     pass
+                raise
+
+        logger.info(f"OCR complete. Searchable PDF overwritten at: {pdf_path}")
+        return pdf_path
 
     def create_text_chunks(self,text_content:str,document_id:str,filename:str)-> List[Document]:
         """This method is used to convert text into chunks if there are text + tables"""
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size = settings.CHUNK_SIZE,
-            chunk_overlap = settings.CHUNK_OVERLAP,
-            separators= ["\n\n","\n"," ",""]
-        )
-    
         if not text_content.strip():
             return []
         
         # Split text into chunks
-        chunks = text_splitter.split_text(text_content)
+        chunks = self._text_splitter.split_text(text_content)
         
-        documents = []
-        for i, chunk in enumerate(chunks):
-            if chunk.strip():  # Only add non-empty chunks
-                doc = Document(
-                    page_content=chunk,
-                    metadata={
-                        'document_id': document_id,
-                        'filename': filename,
-                        'chunk_index': i,
-                        'chunk_type': 'text',
-                        'chunk_id': f"{document_id}_text_{i}"
-                    }
-                )
-                documents.append(doc)
+        chunk_id_prefix = f"{document_id}_text_"
+        documents = [
+            Document(
+                page_content=chunk,
+                metadata={
+                    'document_id': document_id,
+                    'filename': filename,
+                    'chunk_index': i,
+                    'chunk_type': 'text',
+                    'chunk_id': f"{chunk_id_prefix}{i}"
+                }
+            )
+            for i, chunk in enumerate(chunks)
+            if chunk.strip()  # Only add non-empty chunks
+        ]
         
         return documents
     
@@ -294,13 +390,13 @@ class DocumentService:
         if not data_rows:
             return [Document(page_content="\n".join([header, delimiter]), metadata={"split": "header_only"})]
 
+        # Built once and prepended to every block instead of re-joined per chunk
+        prefix = f"{header}\n{delimiter}\n" if keep_header_in_each_chunk else ""
+
         chunks: List[Document] = []
         for start in range(0, len(data_rows), rows_per_chunk):
             block = data_rows[start:start + rows_per_chunk]
-            if keep_header_in_each_chunk:
-                content = "\n".join([header, delimiter] + block)
-            else:
-                content = "\n".join(block)
+            content = prefix + "\n".join(block)
 
             metadata = {
                 "document_id":document_id,
@@ -1,29 +1,93 @@
+import asyncio
+import base64
 from typing import List
-from langchain_openai import OpenAIEmbeddings
+import functools
+import numpy as np
+import tiktoken
+from openai import AsyncOpenAI
 from config import settings
 from utils.logger import logger
+
+# Inputs sent per embeddings request (the API accepts up to 2048)
+EMBEDDING_BATCH_SIZE = 1000
+# Longest input, in tokens, the embedding models accept
+EMBEDDING_CTX_LENGTH = 8191
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def _fits_unencoded(text: str) -> bool:
+    """Whether text is provably within the context length without tokenizing it"""
+    # Byte-level BPE tokens cover at least one UTF-8 byte each, so a text no
+    # longer than the limit in bytes can't be over it in tokens. A character
+    # is at most 4 bytes, which settles ordinary chunks without encoding
+    return len(text) * 4 <= EMBEDDING_CTX_LENGTH or len(text.encode("utf-8")) <= EMBEDDING_CTX_LENGTH
+
 class EmbeddingService:
     def __init__(self):
         if not settings.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
             
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=settings.OPENAI_API_KEY,
-            model=settings.OPENAI_EMBEDDING_MODEL
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.model = settings.OPENAI_EMBEDDING_MODEL
+        # Caps ingest embedding requests in flight across all uploads; queries
+        # bypass it so a large upload can't delay chat
+        self._semaphore = asyncio.Semaphore(settings.EMBED_CONCURRENCY)
+    
+    def _truncate(self, texts: List[str]) -> List[str]:
+        """Cut inputs down to the model's context length, so one oversized chunk doesn't fail its whole batch"""
+        if all(_fits_unencoded(text) for text in texts):
+            return texts
+        
+        encoding = _get_encoding(self.model)
+        truncated = []
+        for text in texts:
+            if not _fits_unencoded(text):
+                tokens = encoding.encode(text, disallowed_special=())
+                if len(tokens) > EMBEDDING_CTX_LENGTH:
+                    logger.warning(f"Truncating embedding input from {len(tokens)} to {EMBEDDING_CTX_LENGTH} tokens")
+                    # Drop a character split by the cut rather than adding a replacement char
+                    text = encoding.decode(tokens[:EMBEDDING_CTX_LENGTH], errors="ignore")
+            truncated.append(text)
+        return truncated
+    
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        """Request float32 embeddings as base64 and decode them straight into an (N, d) array"""
+        texts = self._truncate(texts)
+        response = await self.client.embeddings.create(
+            model=self.model,
+            input=texts,
+            encoding_format="base64"
         )
+        rows = sorted(response.data, key=lambda item: item.index)
+        return np.vstack([np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32) for item in rows])
+    
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one ingest batch, waiting for a free request slot"""
+        async with self._semaphore:
+            return await self._embed(texts)
     
-    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    async def embed_documents(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings for multiple documents"""
         try:
-            return await self.embeddings.aembed_documents(texts)
+            # Send the batches concurrently; gather keeps them in input order
+            batches = await asyncio.gather(*(
+                self._embed_batch(texts[start:start + EMBEDDING_BATCH_SIZE])
+                for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+            ))
+            return batches[0] if len(batches) == 1 else np.vstack(batches)
         except Exception as e:
             logger.info(f"Error generating embeddings for documents: {e}")
             raise
     
-    async def embed_query(self, text: str) -> List[float]:
-        """Generate embedding for a single query"""
+    async def embed_query(self, text: str) -> np.ndarray:
+        """Generate embedding for a single query, shaped (1, d)"""
         try:
-            return await self.embeddings.aembed_query(text)
+            return await self._embed([text])
         except Exception as e:
             logger.info(f"Error generating embedding for query: {e}")
             raise
@@ -1,20 +1,116 @@
 import os
+import math
+import json
+import asyncio
 import pickle
 import faiss
 import numpy as np
-from typing import List, Dict, Any, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import List, Dict, Any, Optional, Tuple
 from langchain.docstore.document import Document
 
 from config import settings
 from services.embedding_service import EmbeddingService
 
+# HNSW graph parameters: neighbours per node and build-time beam width
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+# Upper bound on the vectors used to learn the int8 quantizer ranges
+SQ_TRAINING_SAMPLE = 20_000
+# Filters matching at most this many chunks are scored exactly against the
+# float32 vectors; HNSW stops after efSearch candidates, so a selective
+# filter would leave most of its beam rejected and return too few hits
+EXACT_SEARCH_MAX_IDS = 4096
+
+def _new_index(vectors: np.ndarray) -> faiss.Index:
+    """Build an approximate nearest-neighbour index over L2-normalized vectors (cosine), stored as int8 codes"""
+    index = faiss.IndexHNSWSQ(vectors.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    # Learn the per-dimension value ranges, then encode
+    index.train(vectors[:SQ_TRAINING_SAMPLE])
+    index.add(vectors)
+    return index
+
+# Metadata keys every chunk carries, stored as their own Parquet columns
+DOCUMENT_COLUMNS = ("document_id", "filename", "chunk_id", "chunk_type")
+
+def _documents_to_table(documents: List[Document]) -> pa.Table:
+    """Convert chunks into a columnar table; uncommon metadata keys go into a JSON column"""
+    columns: Dict[str, list] = {name: [] for name in DOCUMENT_COLUMNS}
+    page_content, chunk_index, extra_metadata = [], [], []
+    
+    for doc in documents:
+        metadata = doc.metadata
+        page_content.append(doc.page_content)
+        chunk_index.append(metadata.get("chunk_index"))
+        for name in DOCUMENT_COLUMNS:
+            columns[name].append(metadata.get(name))
+        extra = {k: v for k, v in metadata.items() if k not in DOCUMENT_COLUMNS and k != "chunk_index"}
+        extra_metadata.append(json.dumps(extra) if extra else None)
+    
+    return pa.table({
+        "page_content": pa.array(page_content, type=pa.large_string()),
+        **{name: pa.array(values, type=pa.string()) for name, values in columns.items()},
+        "chunk_index": pa.array(chunk_index, type=pa.int64()),
+        "extra_metadata": pa.array(extra_metadata, type=pa.string()),
+    })
+
+def _table_to_documents(table: pa.Table) -> List[Document]:
+    """Rebuild chunks from a table written by _documents_to_table"""
+    documents = []
+    for row in table.to_pylist():
+        metadata = {name: row[name] for name in (*DOCUMENT_COLUMNS, "chunk_index") if row[name] is not None}
+        if row["extra_metadata"]:
+            metadata.update(json.loads(row["extra_metadata"]))
+        documents.append(Document(page_content=row["page_content"], metadata=metadata))
+    return documents
+
+# Per-chunk metadata: every value is (near) unique, so postings for these
+# would cost a list per chunk and never narrow a search usefully
+UNINDEXED_METADATA = frozenset({"chunk_id", "chunk_index", "row_start", "row_end"})
+
+def _build_postings(documents: List[Document], start: int = 0,
+                    postings: Optional[Dict[Tuple[str, Any], List[int]]] = None) -> Dict[Tuple[str, Any], List[int]]:
+    """Map each hashable (key, value) metadata pair of documents[start:] to its index positions"""
+    if postings is None:
+        postings = {}
+    for position in range(start, len(documents)):
+        for key, value in documents[position].metadata.items():
+            if key in UNINDEXED_METADATA:
+                continue
+            try:
+                postings.setdefault((key, value), []).append(position)
+            except TypeError:
+                # Unhashable values (e.g. column lists) can't be filtered on
+                continue
+    return postings
+
 class VectorService:
     def __init__(self):
         self.embedding_service = EmbeddingService()
         self.index = None
+        # Number of vectors the quantizer ranges were learned from
+        self._trained_on: int = 0
         self.documents = []
+        # Bumped on every mutation so derived caches know when to rebuild
+        self._version: int = 0
+        self._summary_cache: tuple[int, List[Dict[str, Any]]] | None = None
+        # (metadata key, value) -> index positions, for filtered search
+        self._postings: Dict[Tuple[str, Any], List[int]] = {}
+        self._filter_cache: Dict[frozenset, np.ndarray] = {}
+        self._filter_cache_version: int = -1
         self.index_path = os.path.join(settings.VECTOR_STORE_PATH, "faiss_index")
-        self.docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.pkl")
+        self.docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.parquet")
+        self.legacy_docs_path = os.path.join(settings.VECTOR_STORE_PATH, "documents.pkl")
+        # Exact float32 copy of the indexed vectors, row i = index position i;
+        # retraining starts from these rather than from decoded int8 codes
+        self.vectors_path = os.path.join(settings.VECTOR_STORE_PATH, "embeddings.f32")
+        # Rebuilt copy written beside it, swapped in together with the new index
+        self.staged_vectors_path = self.vectors_path + ".tmp"
+        # Serializes mutations; index builds and saves run in a worker thread
+        # while searches keep using the current index until it is swapped
+        self._write_lock = asyncio.Lock()
         
         # Ensure vector store directory exists
         os.makedirs(settings.VECTOR_STORE_PATH, exist_ok=True)
@@ -32,23 +128,23 @@ class VectorService:
             texts = [doc.page_content for doc in documents]
             
             # Generate embeddings
-            embeddings = await self.embedding_service.embed_documents(texts)
-            embeddings_array = np.array(embeddings).astype('float32')
-            
-            # Initialize or update FAISS index
-            if self.index is None:
-                # Create new index
-                dimension = embeddings_array.shape[1]
-                self.index = faiss.IndexFlatL2(dimension)
-            
-            # Add embeddings to index
-            self.index.add(embeddings_array)
+            embeddings_array = await self.embedding_service.embed_documents(texts)
+            # Unit-normalize so inner product equals cosine similarity
+            faiss.normalize_L2(embeddings_array)
             
-            # Store documents
-            self.documents.extend(documents)
-            
-            # Persist to disk
-            self._save_index()
+            async with self._write_lock:
+                # Build the updated index off the event loop
+                index, trained_on = await asyncio.to_thread(self._grow_index, embeddings_array)
+                
+                # Swap it in together with the documents
+                start = len(self.documents)
+                self.index, self._trained_on = index, trained_on
+                self.documents = self.documents + documents
+                self._index_postings(start)
+                self._version += 1
+                
+                # Persist to disk
+                await asyncio.to_thread(self._save_index)
             
             return f"Added {len(documents)} documents to vector store"
             
@@ -56,6 +152,44 @@ class VectorService:
             print(f"Error adding documents to vector store: {e}")
             raise
     
+    def _grow_index(self, vectors: np.ndarray) -> Tuple[faiss.Index, int]:
+        """Return a new index holding the current vectors plus the given ones; the live index is not modified"""
+        if self.index is None:
+            # Create new index
+            index, trained_on = _new_index(vectors), min(len(vectors), SQ_TRAINING_SAMPLE)
+            self._store_vectors(0, vectors)
+            return index, trained_on
+        
+        ntotal = self.index.ntotal
+        if self._trained_on < SQ_TRAINING_SAMPLE and ntotal + len(vectors) >= 2 * self._trained_on:
+            # Ranges learned from a small first upload would clip later
+            # vectors, so relearn them each time the store doubles
+            combined = np.vstack([self._read_vectors(slice(0, ntotal)), vectors])
+            index, trained_on = _new_index(combined), min(len(combined), SQ_TRAINING_SAMPLE)
+        else:
+            # Add embeddings to a copy, since searches may be reading the live index
+            index, trained_on = faiss.clone_index(self.index), self._trained_on
+            index.add(vectors)
+        
+        self._store_vectors(ntotal, vectors)
+        return index, trained_on
+    
+    def _read_vectors(self, rows) -> np.ndarray:
+        """Load the given rows of the float32 vector copy into memory"""
+        # Map only the rows of the current index; an add may be appending past them
+        stored = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                           shape=(self.index.ntotal, self.index.d))
+        return np.array(stored[rows])
+    
+    def _store_vectors(self, start: int, vectors: np.ndarray, path: Optional[str] = None):
+        """Write vectors into the float32 copy from row start on, dropping any rows after them"""
+        path = path or self.vectors_path
+        mode = "r+b" if start and os.path.exists(path) else "wb"
+        with open(path, mode) as f:
+            f.seek(start * vectors.shape[1] * vectors.itemsize)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.truncate()
+    
     async def similarity_search(self, query: str, k: int = 5, filters: Optional[Dict] = None) -> List[Dict]:
         """Perform similarity search"""
         if self.index is None or self.index.ntotal == 0:
@@ -63,29 +197,50 @@ class VectorService:
 
         try:
             # Generate query embedding
-            query_embedding = await self.embedding_service.embed_query(query)
-            query_vector = np.array([query_embedding], dtype='float32')
+            query_vector = await self.embedding_service.embed_query(query)
+            faiss.normalize_L2(query_vector)
+            
+            # From here on nothing awaits, so the index and documents can't be swapped mid-search
+            index, documents = self.index, self.documents
+            if index is None or index.ntotal == 0:
+                return []
             
-            # Search in FAISS index
-            distances, all_indices = self.index.search(query_vector, min(k, self.index.ntotal))
+            allowed_ids = None
+            if filters:
+                allowed_ids = self._filter_ids(filters)
+                if allowed_ids.size == 0:
+                    return []
+                k = min(k, int(allowed_ids.size))
             
-            # FAISS returns 2D arrays, we take the first row (single query)
-            scores = distances[0]        # shape (k,)
-            indices = all_indices[0]     # shape (k,)
+            if allowed_ids is not None and allowed_ids.size <= EXACT_SEARCH_MAX_IDS:
+                scores, indices = self._exact_search(query_vector[0], allowed_ids, k)
+            else:
+                # Widen the HNSW search beam with k to keep recall high
+                ef_search = max(k * 4, 64)
+                params = faiss.SearchParametersHNSW(efSearch=ef_search)
+                if allowed_ids is not None:
+                    # Restrict the search to matching chunks inside FAISS, and
+                    # widen the beam by the filter's selectivity so about as
+                    # many matching candidates are visited as without one
+                    params.efSearch = max(ef_search, min(int(allowed_ids.size),
+                                                         math.ceil(ef_search * index.ntotal / allowed_ids.size)))
+                    params.sel = faiss.IDSelectorBatch(allowed_ids.size, faiss.swig_ptr(allowed_ids))
+                
+                # Search in FAISS index
+                distances, all_indices = index.search(query_vector, min(k, index.ntotal), params=params)
+                
+                # FAISS returns 2D arrays, we take the first row (single query)
+                scores = distances[0]        # shape (k,)
+                indices = all_indices[0]     # shape (k,)
 
             results = []
             for score, idx in zip(scores, indices):
                 idx = int(idx)  # convert to native Python int
-                if 0 <= idx < len(self.documents):
-                    doc = self.documents[idx]
-
-                    # Apply filters if provided
-                    if filters and not self._matches_filters(doc.metadata, filters):
-                        continue
-
+                if 0 <= idx < len(documents):
+                    doc = documents[idx]
                     results.append({
                         'document': doc,
-                        'similarity_score': float(score),  # ensure scalar
+                        'similarity_score': float(score),  # cosine similarity, higher is closer
                         'content': doc.page_content,
                         'metadata': doc.metadata
                     })
@@ -93,92 +248,205 @@ class VectorService:
             return results
 
         except Exception as e:
+            # Re-raise so callers can tell a failed search from an empty result
             print(f"Error performing similarity search: {e}")
-            return []
+            raise
 
+    def _exact_search(self, query: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score the given index positions against their float32 vectors, returning the top k best first"""
+        scores = self._read_vectors(ids) @ query
+        top = np.argpartition(-scores, k - 1)[:k] if k < ids.size else np.arange(ids.size)
+        top = top[np.argsort(-scores[top])]
+        return scores[top], ids[top]
+    
+    def _index_postings(self, start: int = 0):
+        """Record the index positions of documents[start:] in the metadata postings"""
+        _build_postings(self.documents, start, self._postings)
 
-    def _matches_filters(self, metadata: Dict, filters: Dict) -> bool:
-        """Check if document metadata matches the provided filters"""
+    def _reset_postings(self):
+        """Rebuild the metadata postings after positions have shifted"""
+        self._postings = _build_postings(self.documents)
+
+    def _filter_ids(self, filters: Dict) -> np.ndarray:
+        """Sorted int64 index positions whose metadata matches every filter, cached per store version"""
+        try:
+            cache_key = frozenset(filters.items())
+        except TypeError:
+            cache_key = None
+        
+        if cache_key is not None:
+            if self._filter_cache_version != self._version:
+                self._filter_cache = {}
+                self._filter_cache_version = self._version
+            cached = self._filter_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        ids = None
         for key, value in filters.items():
-            if key not in metadata or metadata[key] != value:
-                return False
-        return True
+            if key in UNINDEXED_METADATA:
+                # No postings for per-chunk keys; fall back to a scan
+                positions = np.fromiter(
+                    (i for i, doc in enumerate(self.documents) if doc.metadata.get(key) == value),
+                    dtype='int64')
+            else:
+                try:
+                    positions = np.asarray(self._postings.get((key, value), ()), dtype='int64')
+                except TypeError:
+                    positions = np.empty(0, dtype='int64')
+            ids = positions if ids is None else np.intersect1d(ids, positions, assume_unique=True)
+            if ids.size == 0:
+                break
+        
+        if cache_key is not None:
+            self._filter_cache[cache_key] = ids
+        return ids
     
     def _save_index(self):
         """Save FAISS index and documents to disk"""
         try:
             if self.index is not None:
                 faiss.write_index(self.index, self.index_path)
+            else:
+                # Don't let a stale index be reloaded next to an empty store
+                for path in (self.index_path, self.vectors_path):
+                    if os.path.exists(path):
+                        os.remove(path)
             
-            with open(self.docs_path, 'wb') as f:
-                pickle.dump(self.documents, f)
+            pq.write_table(_documents_to_table(self.documents), self.docs_path)
                 
         except Exception as e:
             print(f"Error saving index: {e}")
     
     def _load_index(self):
         """Load FAISS index and documents from disk"""
-        if os.path.exists(self.index_path) and os.path.exists(self.docs_path):
-            try:
-                self.index = faiss.read_index(self.index_path)
-                with open(self.docs_path, 'rb') as f:
-                    self.documents = pickle.load(f)
-                print(f"Loaded vector store with {len(self.documents)} documents")
-            except Exception as e:
-                print(f"Error loading vector store: {e}")
-                self.index = None
-                self.documents = []
+        if not os.path.exists(self.index_path):
+            return
+        
+        try:
+            if os.path.exists(self.docs_path):
+                documents = _table_to_documents(pq.read_table(self.docs_path))
+            elif os.path.exists(self.legacy_docs_path):
+                # Stores written before the Parquet format; rewritten on next save
+                with open(self.legacy_docs_path, 'rb') as f:
+                    documents = pickle.load(f)
+            else:
+                return
+            
+            self.index = faiss.read_index(self.index_path)
+            self._trained_on = min(self.index.ntotal, SQ_TRAINING_SAMPLE)
+            self.documents = documents
+            self._reset_postings()
+            print(f"Loaded vector store with {len(self.documents)} documents")
+            
+            if not isinstance(self.index, faiss.IndexHNSWSQ):
+                # Stores written with float32 L2 or HNSW indexes: normalize
+                # their vectors into a quantized cosine index
+                vectors = self.index.reconstruct_n(0, self.index.ntotal)
+                faiss.normalize_L2(vectors)
+                self._build_index(vectors)
+                self._store_vectors(0, vectors)
+                self._save_index()
+            elif not self._vectors_in_sync():
+                # Stores saved without (or with a stale) float32 copy: seed it
+                # once from the decoded codes
+                self._store_vectors(0, self.index.reconstruct_n(0, self.index.ntotal))
+        except Exception as e:
+            print(f"Error loading vector store: {e}")
+            self.index = None
+            self.documents = []
+    
+    def _vectors_in_sync(self) -> bool:
+        """Whether the float32 copy holds exactly one row per indexed vector"""
+        expected = self.index.ntotal * self.index.d * np.dtype(np.float32).itemsize
+        return os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) == expected
     
     def get_document_count(self) -> int:
         """Get total number of documents in the vector store"""
         return len(self.documents)
     
+    def summarize_documents(self) -> List[Dict[str, Any]]:
+        """Get per-document chunk counts, cached until the store changes"""
+        if self._summary_cache is not None and self._summary_cache[0] == self._version:
+            return self._summary_cache[1]
+        
+        documents_info = {}
+        for doc in self.documents:
+            doc_id = doc.metadata['document_id']
+            
+            if doc_id not in documents_info:
+                documents_info[doc_id] = {
+                    'document_id': doc_id,
+                    'filename': doc.metadata['filename'],
+                    'total_chunks': 0,
+                    'text_chunks': 0,
+                    'table_chunks': 0
+                }
+            
+            documents_info[doc_id]['total_chunks'] += 1
+            
+            if doc.metadata.get('chunk_type') == 'table':
+                documents_info[doc_id]['table_chunks'] += 1
+            else:
+                documents_info[doc_id]['text_chunks'] += 1
+        
+        summary = list(documents_info.values())
+        self._summary_cache = (self._version, summary)
+        return summary
+    
     def get_documents_by_filename(self, filename: str) -> List[Document]:
         """Get all documents for a specific filename"""
         return [doc for doc in self.documents if doc.metadata.get('filename') == filename]
     
-    def clear_documents(self, document_id: Optional[str] = None):
+    async def clear_documents(self, document_id: Optional[str] = None):
         """Clear all documents or documents for a specific document_id"""
-        if document_id:
-            # Remove specific document
-            original_count = len(self.documents)
-            self.documents = [doc for doc in self.documents if doc.metadata.get('document_id') != document_id]
-            removed_count = original_count - len(self.documents)
-            
-            # Rebuild index after removal
-            if removed_count > 0:
-                self._rebuild_index()
+        async with self._write_lock:
+            if document_id:
+                # Remove specific document, remembering which index positions survive
+                keep = [i for i, doc in enumerate(self.documents) if doc.metadata.get('document_id') != document_id]
+                removed_count = len(self.documents) - len(keep)
                 
-            return f"Removed {removed_count} chunks for document {document_id}"
-        else:
-            # Clear all
-            self.documents = []
-            self.index = None
-            self._save_index()
-            return "Cleared all documents"
+                # Rebuild index after removal, off the event loop
+                if removed_count > 0:
+                    index, trained_on = await asyncio.to_thread(self._rebuild_index, keep)
+                    documents = [self.documents[i] for i in keep]
+                    postings = await asyncio.to_thread(_build_postings, documents)
+                    
+                    if index is not None:
+                        # Searches read the float32 copy by position, so it
+                        # changes over at the same moment as the index
+                        os.replace(self.staged_vectors_path, self.vectors_path)
+                    self.index, self._trained_on = index, trained_on
+                    self.documents, self._postings = documents, postings
+                    self._version += 1
+                    
+                    # Save updated index
+                    await asyncio.to_thread(self._save_index)
+                    
+                return f"Removed {removed_count} chunks for document {document_id}"
+            else:
+                # Clear all
+                self.documents = []
+                self.index = None
+                self._trained_on = 0
+                self._postings = {}
+                self._version += 1
+                await asyncio.to_thread(self._save_index)
+                return "Cleared all documents"
     
-    async def _rebuild_index(self):
-        """Rebuild the FAISS index after document removal"""
-        if not self.documents:
-            self.index = None
-            self._save_index()
-            return
+    def _build_index(self, vectors: np.ndarray):
+        """Replace the FAISS index with one trained on and holding the given vectors"""
+        self.index = _new_index(vectors)
+        self._trained_on = min(len(vectors), SQ_TRAINING_SAMPLE)
+    
+    def _rebuild_index(self, keep: List[int]) -> Tuple[Optional[faiss.Index], int]:
+        """Build a new FAISS index from the stored vectors at the kept positions, without re-embedding"""
+        if not keep or self.index is None:
+            return None, 0
         
-        try:
-            # Extract text content
-            texts = [doc.page_content for doc in self.documents]
-            
-            # Generate embeddings
-            embeddings = await self.embedding_service.embed_documents(texts)
-            embeddings_array = np.array(embeddings).astype('float32')
-            
-            # Create new index
-            dimension = embeddings_array.shape[1]
-            self.index = faiss.IndexFlatL2(dimension)
-            self.index.add(embeddings_array)
-            
-            # Save updated index
-            self._save_index()
-            
-        except Exception as e:
-            print(f"Error rebuilding index: {e}")
+        # HNSW cannot delete in place, so the survivors' original vectors
+        # are copied into a fresh index
+        vectors = self._read_vectors(keep)
+        index = _new_index(vectors)
+        self._store_vectors(0, vectors, self.staged_vectors_path)
+        return index, min(len(vectors), SQ_TRAINING_SAMPLE)
@@ -0,0 +1,4 @@
+from main import app
+
+def test_root_route_registered_once():
+    assert len([route for route in app.routes if route.path == "/"]) == 1
@@ -0,0 +1,16 @@
+from utils.text_utils import DoclingPDFLoader
+
+def test_lazy_load_parallel_converts_every_file(tmp_path):
+    paths = []
+    for name in ("first", "second"):
+        path = tmp_path / f"{name}.md"
+        path.write_text(f"# {name.title()}\n\nBody of the {name} file.\n")
+        paths.append(str(path))
+
+    documents = list(DoclingPDFLoader(paths).lazy_load_parallel(max_workers=2))
+
+    # Results arrive in completion order, so match them up by source
+    by_source = {doc.metadata["source"]: doc.page_content for doc in documents}
+    assert sorted(by_source) == sorted(paths)
+    assert "Body of the first file." in by_source[paths[0]]
+    assert "Body of the second file." in by_source[paths[1]]
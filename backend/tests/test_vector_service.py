@@ -0,0 +1,65 @@
+import asyncio
+import dataclasses
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+import services.vector_service as vector_service_module
+from services.vector_service import VectorService
+
+DIM = 32
+
+class FakeEmbeddingService:
+    """Deterministic random vectors per text, so tests need no API key"""
+    def __init__(self):
+        self._rng = np.random.default_rng(0)
+        self._vectors = {}
+
+    def vector(self, text: str) -> np.ndarray:
+        if text not in self._vectors:
+            self._vectors[text] = self._rng.standard_normal(DIM).astype(np.float32)
+        return self._vectors[text]
+
+    async def embed_documents(self, texts):
+        return np.vstack([self.vector(text) for text in texts])
+
+    async def embed_query(self, text):
+        return self.vector(text)[None].copy()
+
+@pytest.fixture
+def vector_service(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_service_module, "settings",
+                        dataclasses.replace(vector_service_module.settings, VECTOR_STORE_PATH=str(tmp_path)))
+    monkeypatch.setattr(vector_service_module, "EmbeddingService", FakeEmbeddingService)
+    return VectorService()
+
+def _chunks(document_id: str, count: int):
+    return [
+        Document(page_content=f"{document_id}-{i}",
+                 metadata={"document_id": document_id, "filename": f"{document_id}.txt",
+                           "chunk_id": f"{document_id}_{i}", "chunk_index": i, "chunk_type": "text"})
+        for i in range(count)
+    ]
+
+def test_filter_smaller_than_ef_search_returns_k_exact_hits(vector_service):
+    # The filter allows far fewer ids than the HNSW beam (efSearch >= 64)
+    asyncio.run(vector_service.add_documents(_chunks("large", 5000) + _chunks("small", 8)))
+
+    results = asyncio.run(vector_service.similarity_search("question", k=5, filters={"document_id": "small"}))
+
+    embeddings = vector_service.embedding_service
+    query = embeddings.vector("question") / np.linalg.norm(embeddings.vector("question"))
+    expected = sorted(
+        (f"small-{i}" for i in range(8)),
+        key=lambda text: -float(embeddings.vector(text) @ query / np.linalg.norm(embeddings.vector(text))),
+    )[:5]
+    assert [result["content"] for result in results] == expected
+
+def test_filter_after_delete_reads_rebuilt_vectors(vector_service):
+    asyncio.run(vector_service.add_documents(_chunks("a", 50) + _chunks("b", 50) + _chunks("c", 3)))
+    asyncio.run(vector_service.clear_documents("b"))
+
+    results = asyncio.run(vector_service.similarity_search("question", k=5, filters={"document_id": "c"}))
+
+    assert sorted(result["content"] for result in results) == ["c-0", "c-1", "c-2"]
+    assert vector_service._vectors_in_sync()
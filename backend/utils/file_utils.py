@@ -1,16 +1,13 @@
 import os
 from typing import List
-from pathlib import Path
 from utils.logger import logger
 
-ALLOWED_EXTENSIONS = {".pdf",".txt",".docx",".xlsx"}
+ALLOWED_EXTENSIONS = frozenset({".pdf",".txt",".docx",".xlsx"})
+
+def get_file_extension(filename:str)-> str:
+    """Get the lower-cased file extension, including the leading dot"""
+    return os.path.splitext(filename)[1].lower()
 
-def validate_file_type(filename:str)-> bool:
-    """Check if file type is supported"""
-    file_extension = Path(filename).suffix.lower()
-    logger.info(f"file extension is {file_extension}")
-    return file_extension in ALLOWED_EXTENSIONS
-    
 def get_file_size(file_path:str)-> int:
     """Get file size in bytes"""
     file_size = os.path.getsize(file_path)
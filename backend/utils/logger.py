@@ -1,50 +1,185 @@
 # logger.py
 
 from loguru import logger
+import atexit
+import os
 import sys
+import threading
+import time
+from datetime import datetime, timedelta
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# Remove default handlers
-logger.remove()
-
-# Console log format with file name and line number
+# Console log format with module and line number
 CONSOLE_FORMAT = (
     "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
     "<level>{level:<8}</level> | "
     "<cyan>{module}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> "
-    "({file.name}) - <level>{message}</level>"
+    "- <level>{message}</level>"
 )
 
-# File log format with file path and line number
+# File log format with module and line number
 FILE_FORMAT = (
     "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level:<8} | "
-    "{module}:{function}:{line} ({file.path}) - {message}"
+    "{module}:{function}:{line} - {message}"
 )
 
-# Ensure the log directory exists
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-
-# Add a stdout handler
-logger.add(
-    sys.stdout,
-    format=CONSOLE_FORMAT,
-    level="DEBUG",
-    colorize=True,
-    backtrace=True,    # Capture full stack trace
-    diagnose=True,     # Show local variables in tracebacks
-)
+# Absolute, so rotation keeps working if the process later changes directory
+_LOG_PATH = Path("logs/app.log").resolve()
 
-# Add a rolling file handler
-logger.add(
-    log_dir / "app.log",
-    rotation="10 MB",
-    retention="10 days",
-    compression="zip",
-    level="DEBUG",
-    format=FILE_FORMAT,
-    backtrace=True,
-    diagnose=True,
-)
+# The active log file is rolled at midnight or once it reaches this size
+LOG_MAX_BYTES = 10 * 1024 * 1024
+# Bytes written between checks that correct the in-memory size estimate
+LOG_STAT_INTERVAL_BYTES = 10 * 1024
+# Records are buffered in memory and flushed when the buffer fills or on this interval
+LOG_BUFFER_BYTES = 64 * 1024
+LOG_FLUSH_INTERVAL_SECONDS = 1.0
+# After a failed rotation, keep writing to the current file and retry this much later
+LOG_ROTATE_RETRY_SECONDS = 60.0
+
+# Rolled log archives older than this are deleted
+LOG_RETENTION_SECONDS = 10 * 24 * 60 * 60
+
+# Zips rolled files and prunes old archives off the logging thread
+_housekeeping = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-housekeeping")
+
+def _archive_log(path: str) -> None:
+    """Zip a rolled log file, then delete archives past the retention window"""
+    rolled = Path(path)
+    try:
+        with zipfile.ZipFile(f"{rolled}.zip", "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.write(rolled, arcname=rolled.name)
+        rolled.unlink()
+
+        cutoff = time.time() - LOG_RETENTION_SECONDS
+        for old in rolled.parent.glob("*.zip"):
+            if old.stat().st_mtime < cutoff:
+                old.unlink()
+    except OSError as e:
+        print(f"Log housekeeping failed for {rolled}: {e}", file=sys.stderr)
+
+class _RotatingFileSink:
+    """Loguru sink that appends to a log file and rolls it daily or by size.
+
+    The file size is tracked in memory from the bytes written and only
+    checked against the file every LOG_STAT_INTERVAL_BYTES, instead of
+    stat-ing it on every record. Writes go through a LOG_BUFFER_BYTES buffer
+    that a background thread flushes every LOG_FLUSH_INTERVAL_SECONDS, so at
+    most that much output is lost on a crash.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._rotate_retry_at = 0.0
+        self._open()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+        self._flusher.start()
+
+    def _open(self) -> None:
+        self._file = open(self._path, "ab", buffering=LOG_BUFFER_BYTES)
+        self._estimated_size = self._file.tell()
+        self._bytes_since_stat = 0
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        self._rollover_at = datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def __call__(self, message: str) -> None:
+        data = message.encode("utf-8")
+        with self._lock:
+            if self._file.closed:
+                # A reopen after rotation failed; try again rather than stay closed
+                self._open()
+            self._file.write(data)
+            self._estimated_size += len(data)
+            self._bytes_since_stat += len(data)
+
+            if self._bytes_since_stat > LOG_STAT_INTERVAL_BYTES:
+                # The position includes bytes still sitting in the buffer
+                self._estimated_size = self._file.tell()
+                self._bytes_since_stat = 0
+
+            now = time.time()
+            if (self._estimated_size >= LOG_MAX_BYTES or now >= self._rollover_at) and now >= self._rotate_retry_at:
+                self._rotate()
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(LOG_FLUSH_INTERVAL_SECONDS):
+            with self._lock:
+                if not self._file.closed:
+                    self._file.flush()
+
+    def _rotate(self) -> None:
+        """Rename the active file aside, reopen a fresh one and archive the old one in the background"""
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        rolled = self._path.with_name(f"{self._path.stem}.{stamp}{self._path.suffix}")
+        renamed = False
+        try:
+            self._file.close()
+            os.replace(self._path, rolled)
+            renamed = True
+        except OSError as e:
+            print(f"Log rotation failed for {self._path}: {e}", file=sys.stderr)
+            self._rotate_retry_at = time.time() + LOG_ROTATE_RETRY_SECONDS
+        finally:
+            # Reopen whether or not the rename worked (the original path if it
+            # didn't), so the sink never stays closed
+            self._open()
+        if renamed:
+            _housekeeping.submit(_archive_log, str(rolled))
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._file.close()
+
+# Survives importlib.reload, which re-executes this module in the same namespace
+_CONFIGURED = globals().get("_CONFIGURED", False)
+
+def _configure() -> None:
+    """Install the stdout and file sinks once per process"""
+    global _CONFIGURED
+    if _CONFIGURED:
+        return
+    _CONFIGURED = True
+
+    # Remove default handlers
+    logger.remove()
+
+    # Ensure the log directory exists
+    _LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+    # Add a stdout handler
+    logger.add(
+        sys.stdout,
+        format=CONSOLE_FORMAT,
+        level="DEBUG",
+        colorize=True,
+        backtrace=True,    # Capture full stack trace
+        diagnose=True,     # Show local variables in tracebacks
+    )
+
+    # Add a rolling file handler; records are queued and written by a
+    # background thread so request handlers never wait on file I/O, and rolled
+    # files are compressed and pruned by the housekeeping thread
+    file_sink = _RotatingFileSink(_LOG_PATH)
+    handler_id = logger.add(
+        file_sink,
+        level="DEBUG",
+        format=FILE_FORMAT,
+        enqueue=True,
+        backtrace=False,   # Full traces and locals already go to stdout
+        diagnose=False,
+    )
+
+    # Drain the queue into the file before closing it at shutdown
+    atexit.register(_close_file_sink, handler_id, file_sink)
+
+def _close_file_sink(handler_id: int, file_sink: _RotatingFileSink) -> None:
+    logger.remove(handler_id)
+    file_sink.close()
+
+_configure()
 
 __all__ = ["logger"]
@@ -1,15 +1,50 @@
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from docling.document_converter import DocumentConverter
-from typing import Iterator
+from typing import Iterator, Optional
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document
 
+# Each worker loads its own copy of Docling's models, so keep the pool small
+PARALLEL_LOAD_MAX_WORKERS = 2
+
+@functools.lru_cache(maxsize=1)
+def _get_converter() -> DocumentConverter:
+    """Build the process-wide converter once, so Docling's models load on first use only"""
+    return DocumentConverter()
+
+def _convert_to_markdown(source: str) -> str:
+    """Convert one file to markdown inside a pool worker"""
+    return _get_converter().convert(source).document.export_to_markdown()
+
 class DoclingPDFLoader(BaseLoader):
     def __init__(self, file_path:str | list[str]) -> None:
         self.file_paths = file_path if isinstance(file_path,list) else [file_path]
-        self.convertor = DocumentConverter()
+        self.convertor = _get_converter()
 
     def lazy_load(self) -> Iterator[Document]:
         for source in self.file_paths:
-            d1_doc = self.convertor.convert(source).document
-            text = d1_doc.export_to_markdown()
-            yield Document(page_content=text, metadata = {"source":source})
\ No newline at end of file
+            # Keep no reference to the converted DoclingDocument, so its tree
+            # is freed before the markdown is handed to the caller
+            text = self.convertor.convert(source).document.export_to_markdown()
+            yield Document(page_content=text, metadata = {"source":source})
+
+    def lazy_load_parallel(self, max_workers: Optional[int] = None) -> Iterator[Document]:
+        """Convert files across worker processes, yielding each Document as soon as it is ready.
+
+        Workers are spawned, not forked, so each one starts a fresh interpreter
+        that re-imports the calling program's main module (guard its entry
+        point with ``if __name__ == "__main__"``) and loads its own converter.
+        """
+        if len(self.file_paths) < 2:
+            # Not worth spawning workers (and loading models in them) for one file
+            yield from self.lazy_load()
+            return
+
+        max_workers = min(max_workers or PARALLEL_LOAD_MAX_WORKERS, len(self.file_paths))
+        # Spawn rather than fork: forking a multithreaded server can deadlock the child
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(_convert_to_markdown, source): source for source in self.file_paths}
+            for future in as_completed(futures):
+                yield Document(page_content=future.result(), metadata = {"source":futures[future]})
@@ -1,21 +1,15 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import uuid
-from datetime import datetime
+import secrets
 import time
+from collections import deque
 from typing import Dict, List, Any
 
-# Page configuration
-st.set_page_config(
-    page_title="AI Document QA Agent",
-    page_icon="📚",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Custom CSS
-st.markdown("""
+# Static page content, defined once rather than rebuilt inline
+_CSS = """
 <style>
 .stChat > div {
     padding-bottom: 1rem;
@@ -43,17 +37,55 @@ st.markdown("""
     margin: 0.5rem 0;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+_TIPS_MD = """
+**For Text Documents:**
+- Ask specific questions about content, topics, or concepts
+- Request summaries or key points
+- Ask for quotes or specific information
+
+**For Tables:**
+- Ask about specific data values or comparisons
+- Request calculations or aggregations
+- Ask about trends or patterns in the data
+
+**General Tips:**
+- Be specific in your questions
+- Reference document names when asking about multiple documents
+- Ask follow-up questions to dive deeper into topics
+"""
+
+# Page configuration
+st.set_page_config(
+    page_title="AI Document QA Agent",
+    page_icon="📚",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Custom CSS
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # Configuration
 API_BASE_URL = "http://localhost:8000"
 
 # Initialize session state
 if 'session_id' not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
+    st.session_state.session_id = secrets.token_hex(16)
+    st.session_state.session_id_short = st.session_state.session_id[:12]
+
+# Number of messages kept for display; older ones drop off
+CHAT_HISTORY_LIMIT = 200
 
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
+
+if 'user_msg_count' not in st.session_state:
+    st.session_state.user_msg_count = 0
+
+if 'total_chunks' not in st.session_state:
+    st.session_state.total_chunks = 0
 
 if 'documents' not in st.session_state:
     st.session_state.documents = []
@@ -61,20 +93,41 @@ if 'documents' not in st.session_state:
 if 'last_upload_time' not in st.session_state:
     st.session_state.last_upload_time = None
 
+if 'http_session' not in st.session_state:
+    # Reused across reruns so API calls share keep-alive connections
+    http_session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.1)
+    )
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+    st.session_state.http_session = http_session
+
+# Citation markup, filled in per source by format_sources
+_TABLE_TMPL = """
+<div class="table-info">
+<strong>🔢 Table Source {0}:</strong> {1}<br>
+<strong>Table Info:</strong> {2}<br>
+<strong>Columns:</strong> {3}<br>
+<em>Preview:</em> {4}
+</div>
+"""
+
+_TEXT_TMPL = """
+<div class="citation-box">
+<strong>📄 Text Source {0}:</strong> {1}<br>
+<em>Preview:</em> {2}
+</div>
+"""
+
 # Helper functions
 def make_api_request(endpoint: str, method: str = "GET", **kwargs) -> Dict[str, Any]:
     """Make API request with error handling"""
     try:
         url = f"{API_BASE_URL}{endpoint}"
-        
-        if method == "GET":
-            response = requests.get(url, **kwargs)
-        elif method == "POST":
-            response = requests.post(url, **kwargs)
-        elif method == "DELETE":
-            response = requests.delete(url, **kwargs)
-        else:
-            raise ValueError(f"Unsupported method: {method}")
+        response = st.session_state.http_session.request(method, url, **kwargs)
         
         response.raise_for_status()
         return {"success": True, "data": response.json()}
@@ -82,22 +135,38 @@ def make_api_request(endpoint: str, method: str = "GET", **kwargs) -> Dict[str,
     except requests.exceptions.RequestException as e:
         return {"success": False, "error": str(e)}
 
-def load_documents():
-    """Load documents list from API"""
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_documents() -> List[Dict[str, Any]]:
+    """Fetch documents list from API, cached so reruns skip the request"""
     result = make_api_request("/documents")
-    if result["success"]:
-        st.session_state.documents = result["data"]["documents"]
-    else:
-        st.error(f"Failed to load documents: {result['error']}")
+    if not result["success"]:
+        # Raised rather than returned so failures are not cached
+        raise requests.exceptions.RequestException(result["error"])
+    return result["data"]["documents"]
+
+def load_documents():
+    """Load documents list, from cache unless it was invalidated"""
+    try:
+        st.session_state.documents = fetch_documents()
+        st.session_state.total_chunks = sum(doc.get('total_chunks', 0) for doc in st.session_state.documents)
+    except requests.exceptions.RequestException as e:
+        st.error(f"Failed to load documents: {e}")
+
+def invalidate_documents():
+    """Force the next load_documents call to refetch"""
+    # The list is shared by every session, so drop the cached copy for all of them
+    fetch_documents.clear()
 
 def upload_document(uploaded_file) -> bool:
     """Upload document to API"""
     try:
-        # Convert Streamlit uploaded file into a proper tuple for requests
+        # Pass the file object itself so requests reads it into the multipart
+        # body directly, without an extra getvalue() copy
+        uploaded_file.seek(0)
         files = {
             "file": (
                 uploaded_file.name,
-                uploaded_file.getvalue(),   # Ensure we pass bytes, not the file object
+                uploaded_file,
                 uploaded_file.type or "application/octet-stream"
             )
         }
@@ -113,9 +182,9 @@ def upload_document(uploaded_file) -> bool:
                 f"({doc_info.get('text_chunks', 0)} text, {doc_info.get('table_chunks', 0)} tables)"
             )
 
-            # Update documents list
-            load_documents()
-            st.session_state.last_upload_time = datetime.now()
+            # Update documents list on the next load
+            invalidate_documents()
+            st.session_state.last_upload_time = time.monotonic()
             return True
 
         else:
@@ -127,29 +196,100 @@ def upload_document(uploaded_file) -> bool:
         return False
 
 
-def send_chat_message(message: str) -> Dict[str, Any]:
-    """Send chat message to API"""
+def send_chat_message(message: str, placeholder) -> Dict[str, Any]:
+    """Send chat message to API, rendering the answer into placeholder as it streams in"""
     chat_data = {
         "message": message,
         "session_id": st.session_state.session_id
     }
     
-    result = make_api_request("/chat", method="POST", json=chat_data, headers={"Content-Type": "application/json"})
+    answer = ""
+    sources = []
+    done = False
+    try:
+        with st.session_state.http_session.post(
+            f"{API_BASE_URL}/chat/stream", json=chat_data, stream=True
+        ) as response:
+            response.raise_for_status()
+            
+            # One JSON event per line: sources first, then answer tokens
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                
+                if event["type"] == "sources":
+                    sources = event["sources"]
+                    # Flatten table details once, so rendering reads plain keys
+                    for source in sources:
+                        table_info = source.get('table_info') or {}
+                        source['_shape'] = table_info.get('shape') or 'Unknown shape'
+                        source['_cols'] = ', '.join(table_info.get('columns') or ())
+                elif event["type"] == "token":
+                    answer += event["content"]
+                    placeholder.markdown(answer + "▌")
+                elif event["type"] == "done":
+                    done = True
+                elif event["type"] == "error":
+                    return {
+                        "answer": event["answer"],
+                        "sources": [],
+                        "session_id": st.session_state.session_id,
+                        "success": False
+                    }
+        
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {
+            "answer": f"❌ Error: {e}",
+            "sources": [],
+            "session_id": st.session_state.session_id,
+            "success": False
+        }
     
-    if result["success"]:
-        return result["data"]
-    else:
+    if not done:
+        # The stream closed mid-answer (e.g. the backend went away), so the
+        # text so far is incomplete and must not be kept as the reply
         return {
-            "answer": f"❌ Error: {result['error']}",
+            "answer": "❌ Error: the response was cut off before it finished. Please try again.",
             "sources": [],
             "session_id": st.session_state.session_id,
             "success": False
         }
+    
+    return {
+        "answer": answer,
+        "sources": sources,
+        "session_id": st.session_state.session_id,
+        "success": True
+    }
+
+def format_sources(sources: List[Dict[str, Any]]) -> str:
+    """Build the citation markup of an assistant message, once when it arrives"""
+    parts = []
+    for i, source in enumerate(sources, 1):
+        if source.get('chunk_type', 'text') == 'table':
+            parts.append(_TABLE_TMPL.format(
+                i,
+                source['filename'],
+                source['_shape'],
+                source['_cols'],
+                source['content_preview']
+            ))
+        else:
+            parts.append(_TEXT_TMPL.format(i, source['filename'], source['content_preview']))
+    return "".join(parts)
+
+def render_sources(sources_html: str):
+    """Render the pre-built citations of an assistant message"""
+    with st.expander("📚 Sources & Citations", expanded=False):
+        st.markdown(sources_html, unsafe_allow_html=True)
 
 # Sidebar for document management
 with st.sidebar:
     st.title("📚 Document Management")
     
+    load_documents()
+    
     # Document upload section
     st.subheader("Upload Document")
     uploaded_file = st.file_uploader(
@@ -161,7 +301,7 @@ with st.sidebar:
     
     if uploaded_file is not None:
         # Show file info
-        file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+        file_size_mb = uploaded_file.size / (1024 * 1024)
         st.write(f"**File:** {uploaded_file.name}")
         st.write(f"**Size:** {file_size_mb:.1f} MB")
         st.write(f"**Type:** {uploaded_file.type}")
@@ -176,10 +316,7 @@ with st.sidebar:
     st.subheader("📄 Processed Documents")
     
     if st.button("🔄 Refresh Documents", key="refresh_docs"):
-        load_documents()
-    
-    # Load documents on first run
-    if not st.session_state.documents:
+        invalidate_documents()
         load_documents()
     
     if st.session_state.documents:
@@ -195,7 +332,7 @@ with st.sidebar:
                     result = make_api_request(f"/documents/{doc['document_id']}", method="DELETE")
                     if result["success"]:
                         st.success("Document deleted successfully!")
-                        load_documents()
+                        invalidate_documents()
                         st.rerun()
                     else:
                         st.error(f"Failed to delete: {result['error']}")
@@ -206,11 +343,12 @@ with st.sidebar:
     st.divider()
     st.subheader("💬 Session Info")
     
-    st.write(f"**Session ID:** `{st.session_state.session_id[:12]}...`")
-    st.write(f"**Messages:** {len([m for m in st.session_state.chat_history if m['role'] == 'user'])}")
+    st.write(f"**Session ID:** `{st.session_state.session_id_short}...`")
+    st.write(f"**Messages:** {st.session_state.user_msg_count}")
     
     if st.button("🗑️ Clear Chat History", key="clear_chat"):
-        st.session_state.chat_history = []
+        st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)
+        st.session_state.user_msg_count = 0
         # Also clear on server side
         make_api_request(f"/sessions/{st.session_state.session_id}", method="DELETE")
         st.success("Chat history cleared!")
@@ -233,91 +371,36 @@ with chat_container:
             st.markdown(message["content"])
             
             # Display sources for assistant messages
-            if message["role"] == "assistant" and "sources" in message and message["sources"]:
-                with st.expander("📚 Sources & Citations", expanded=False):
-                    for i, source in enumerate(message["sources"], 1):
-                        source_type = source.get('chunk_type', 'text')
-                        
-                        if source_type == 'table':
-                            st.markdown(
-                                f"""
-                                <div class="table-info">
-                                <strong>🔢 Table Source {i}:</strong> {source['filename']}<br>
-                                <strong>Table Info:</strong> {source.get('table_info', {}).get('shape', 'Unknown shape')}<br>
-                                <strong>Columns:</strong> {', '.join(source.get('table_info', {}).get('columns', []))}<br>
-                                <em>Preview:</em> {source['content_preview']}
-                                </div>
-                                """, 
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            st.markdown(
-                                f"""
-                                <div class="citation-box">
-                                <strong>📄 Text Source {i}:</strong> {source['filename']}<br>
-                                <em>Preview:</em> {source['content_preview']}
-                                </div>
-                                """, 
-                                unsafe_allow_html=True
-                            )
+            if message["role"] == "assistant" and message.get("sources_html"):
+                render_sources(message["sources_html"])
 
 # Chat input
 if prompt := st.chat_input("Ask a question about your documents..."):
     # Add user message to chat history
     st.session_state.chat_history.append({"role": "user", "content": prompt})
+    st.session_state.user_msg_count += 1
     
     # Display user message
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    # Get AI response
+    # Stream the AI response; it is rendered with its sources by the history loop on rerun
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response_data = send_chat_message(prompt)
-            
-            answer = response_data['answer']
-            sources = response_data.get('sources', [])
-            
-            st.markdown(answer)
-            
-            # Add to chat history with sources
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": answer,
-                "sources": sources
-            })
-            
-            # Display sources if available
-            if sources:
-                with st.expander("📚 Sources & Citations", expanded=False):
-                    for i, source in enumerate(sources, 1):
-                        source_type = source.get('chunk_type', 'text')
-                        
-                        if source_type == 'table':
-                            st.markdown(
-                                f"""
-                                <div class="table-info">
-                                <strong>🔢 Table Source {i}:</strong> {source['filename']}<br>
-                                <strong>Table Info:</strong> {source.get('table_info', {}).get('shape', 'Unknown shape')}<br>
-                                <strong>Columns:</strong> {', '.join(source.get('table_info', {}).get('columns', []))}<br>
-                                <em>Preview:</em> {source['content_preview']}
-                                </div>
-                                """, 
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            st.markdown(
-                                f"""
-                                <div class="citation-box">
-                                <strong>📄 Text Source {i}:</strong> {source['filename']}<br>
-                                <em>Preview:</em> {source['content_preview']}
-                                </div>
-                                """, 
-                                unsafe_allow_html=True
-                            )
-            
-            # Auto-refresh to show new message
-            st.rerun()
+        placeholder = st.empty()
+        placeholder.markdown("_Thinking..._")
+        response_data = send_chat_message(prompt, placeholder)
+    
+    # Add to chat history with sources, formatted once so reruns only replay the markup
+    sources = response_data.get('sources', [])
+    st.session_state.chat_history.append({
+        "role": "assistant", 
+        "content": response_data['answer'],
+        "sources": sources,
+        "sources_html": format_sources(sources)
+    })
+    
+    # Auto-refresh to show new message
+    st.rerun()
 
 # Footer with metrics
 st.divider()
@@ -328,21 +411,20 @@ with col1:
     st.metric("📄 Documents", len(st.session_state.documents))
 
 with col2:
-    total_chunks = sum(doc.get('total_chunks', 0) for doc in st.session_state.documents)
-    st.metric("📊 Total Chunks", total_chunks)
+    st.metric("📊 Total Chunks", st.session_state.total_chunks)
 
 with col3:
-    st.metric("💬 Messages", len([m for m in st.session_state.chat_history if m["role"] == "user"]))
+    st.metric("💬 Messages", st.session_state.user_msg_count)
 
 with col4:
-    if st.session_state.last_upload_time:
-        time_diff = datetime.now() - st.session_state.last_upload_time
-        if time_diff.total_seconds() < 60:
+    if st.session_state.last_upload_time is not None:
+        seconds = time.monotonic() - st.session_state.last_upload_time
+        if seconds < 60:
             last_upload = "Just now"
-        elif time_diff.total_seconds() < 3600:
-            last_upload = f"{int(time_diff.total_seconds() / 60)}m ago"
+        elif seconds < 3600:
+            last_upload = f"{int(seconds // 60)}m ago"
         else:
-            last_upload = f"{int(time_diff.total_seconds() / 3600)}h ago"
+            last_upload = f"{int(seconds // 3600)}h ago"
     else:
         last_upload = "Never"
     
@@ -350,19 +432,4 @@ with col4:
 
 # Add some helpful tips
 with st.expander("💡 Tips for Better Results", expanded=False):
-    st.markdown("""
-    **For Text Documents:**
-    - Ask specific questions about content, topics, or concepts
-    - Request summaries or key points
-    - Ask for quotes or specific information
-    
-    **For Tables:**
-    - Ask about specific data values or comparisons
-    - Request calculations or aggregations
-    - Ask about trends or patterns in the data
-    
-    **General Tips:**
-    - Be specific in your questions
-    - Reference document names when asking about multiple documents
-    - Ask follow-up questions to dive deeper into topics
-    """)
+    st.markdown(_TIPS_MD)